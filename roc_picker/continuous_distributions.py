@@ -1,40 +1,188 @@
-import matplotlib.pyplot as plt, numpy as np, scipy.integrate
+import concurrent.futures, matplotlib.pyplot as plt, numpy as np, os, scipy.integrate
 
-def optimize(*, X, Y, Xdot, Ydot, AUC, Lambda_guess, t_guess=None, guess=None, Lambda_scaling=1):
+#set this environment variable to pop up diagnostic plots when the
+#xy_guess sanity checks fail
+_DEBUG_PLOT = bool(os.environ.get("ROC_PICKER_DEBUG_PLOT"))
+
+try:
+  import numba
+except ImportError:
+  numba = None
+
+def _is_njit_compiled(function):
+  return numba is not None and isinstance(function, numba.core.dispatcher.Dispatcher)
+
+if numba is not None:
+  #module-level kernels rather than closures inside optimize: closures
+  #would be recompiled on every call, these compile once per process and
+  #get reused across a whole AUC scan.  solve_bvp only accepts python
+  #callables (no LowLevelCallable), so optimize wraps these in thin
+  #lambdas that bind Xdot, Ydot, and the scalar constants.
+  @numba.njit(fastmath=True)
+  def _bvp_fun(t, xy, params, Xdot, Ydot, Lambda_scaling):
+    Lambda = params[0] * Lambda_scaling
+    c1 = params[1]
+    c2 = params[2]
+    out = np.empty((2, t.size))
+    out[0] = 2 * Xdot(t) / (+Lambda * xy[1] + c1)
+    out[1] = 2 * Ydot(t) / (-Lambda * xy[0] + c2)
+    return out
+
+  @numba.njit(fastmath=True)
+  def _bvp_bc(xyminusinfinity, xyplusinfinity, params, Lambda_scaling, AUC, NX):
+    Lambda = params[0] * Lambda_scaling
+    c1 = params[1]
+    return np.array([
+      xyminusinfinity[0],
+      xyminusinfinity[1],
+      xyplusinfinity[0]-1,
+      xyplusinfinity[1]-1,
+      Lambda * AUC + c1 - 2*NX,
+    ])
+
+  @numba.njit(fastmath=True)
+  def _bvp_fun_jac(t, xy, params, Xdot, Ydot, Lambda_scaling):
+    Lambda = params[0] * Lambda_scaling
+    c1 = params[1]
+    c2 = params[2]
+    denx = +Lambda * xy[1] + c1
+    deny = -Lambda * xy[0] + c2
+    Xd = 2 * Xdot(t)
+    Yd = 2 * Ydot(t)
+    dfun_dxy = np.zeros((2, 2, t.size))
+    dfun_dxy[0, 1] = -Xd * Lambda / denx**2
+    dfun_dxy[1, 0] = +Yd * Lambda / deny**2
+    dfun_dparams = np.zeros((2, 3, t.size))
+    dfun_dparams[0, 0] = -Xd * xy[1] * Lambda_scaling / denx**2
+    dfun_dparams[0, 1] = -Xd / denx**2
+    dfun_dparams[1, 0] = +Yd * xy[0] * Lambda_scaling / deny**2
+    dfun_dparams[1, 2] = -Yd / deny**2
+    return dfun_dxy, dfun_dparams
+
+  @numba.njit(fastmath=True)
+  def _bvp_bc_jac(xyminusinfinity, xyplusinfinity, params, Lambda_scaling, AUC):
+    dbc_dxya = np.zeros((5, 2))
+    dbc_dxya[0, 0] = 1
+    dbc_dxya[1, 1] = 1
+    dbc_dxyb = np.zeros((5, 2))
+    dbc_dxyb[2, 0] = 1
+    dbc_dxyb[3, 1] = 1
+    dbc_dparams = np.zeros((5, 3))
+    dbc_dparams[4, 0] = AUC * Lambda_scaling
+    dbc_dparams[4, 1] = 1
+    return dbc_dxya, dbc_dxyb, dbc_dparams
+
+def _as_callable_dot(dot):
+  #Xdot and Ydot can be given either as callables or as (grid, values)
+  #samples on a fixed grid; resolve the choice once here rather than
+  #branching on every RHS evaluation
+  if callable(dot):
+    return dot
+  grid, values = dot
+  grid = np.asarray(grid)
+  values = np.asarray(values)
+  def interpolated(t):
+    return np.interp(t, grid, values)
+  return interpolated
+
+def optimize(*, X, Y, Xdot, Ydot, AUC, Lambda_guess, t_guess=None, guess=None, Lambda_scaling=1, tol=1e-3):
+  Xdot = _as_callable_dot(Xdot)
+  Ydot = _as_callable_dot(Ydot)
   NX = X(np.inf)
   NY = Y(np.inf)
 
-  def fun(t, xy, params):
-    x, y = xy
-    Lambda, c1, c2 = params
-    Lambda *= Lambda_scaling
+  #solve_bvp calls fun and bc many times per Newton iteration, so if Xdot and
+  #Ydot are njit compiled, compile the whole RHS and boundary condition with
+  #numba to skip the interpreter dispatch per call.  Otherwise fall back to
+  #plain python.
+  if _is_njit_compiled(Xdot) and _is_njit_compiled(Ydot):
+    def fun(t, xy, params):
+      return _bvp_fun(t, xy, params, Xdot, Ydot, Lambda_scaling)
+    def bc(xyminusinfinity, xyplusinfinity, params):
+      return _bvp_bc(xyminusinfinity, xyplusinfinity, params, Lambda_scaling, AUC, NX)
+    def fun_jac(t, xy, params):
+      return _bvp_fun_jac(t, xy, params, Xdot, Ydot, Lambda_scaling)
+    def bc_jac(xyminusinfinity, xyplusinfinity, params):
+      return _bvp_bc_jac(xyminusinfinity, xyplusinfinity, params, Lambda_scaling, AUC)
+  else:
+    def fun(t, xy, params):
+      #solve_bvp calls fun with t of shape (m,) and xy of shape (2, m),
+      #so Xdot and Ydot have to be vectorized.  Fill a preallocated
+      #(2, m) array instead of returning a python list that numpy has to
+      #convert back.
+      Lambda, c1, c2 = params
+      Lambda *= Lambda_scaling
+
+      #intermediate Newton iterates can pass through zero denominators;
+      #the resulting infs are backtracked away by the solver, so don't
+      #let them raise under warnings-as-errors
+      out = np.empty_like(xy)
+      with np.errstate(divide="ignore"):
+        np.divide(2 * Xdot(t), +Lambda * xy[1] + c1, out=out[0])
+        np.divide(2 * Ydot(t), -Lambda * xy[0] + c2, out=out[1])
+      return out
 
-    xdot = 2 * Xdot(t) / (+Lambda * y + c1)
-    ydot = 2 * Ydot(t) / (-Lambda * x + c2)
+    def bc(xyminusinfinity, xyplusinfinity, params):
+      xminusinfinity, yminusinfinity = xyminusinfinity
+      xplusinfinity, yplusinfinity = xyplusinfinity
+      Lambda, c1, c2 = params
+      Lambda *= Lambda_scaling
 
-    return [xdot, ydot]
+      bcs = [xminusinfinity, yminusinfinity, xplusinfinity-1, yplusinfinity-1, Lambda * AUC + c1 - 2*NX, -Lambda * (1-AUC) + c2 - 2*NY]
+      return np.asarray(bcs[:-1])
 
-  def bc(xyminusinfinity, xyplusinfinity, params):
-    xminusinfinity, yminusinfinity = xyminusinfinity
-    xplusinfinity, yplusinfinity = xyplusinfinity
-    Lambda, c1, c2 = params
-    Lambda *= Lambda_scaling
+    def fun_jac(t, xy, params):
+      #the RHS is a simple rational function, so give solve_bvp the
+      #closed-form partials instead of letting it finite-difference them
+      Lambda, c1, c2 = params
+      Lambda *= Lambda_scaling
+      denx = +Lambda * xy[1] + c1
+      deny = -Lambda * xy[0] + c2
+      Xd = 2 * Xdot(t)
+      Yd = 2 * Ydot(t)
+      dfun_dxy = np.zeros((2, 2, t.size))
+      dfun_dparams = np.zeros((2, 3, t.size))
+      with np.errstate(divide="ignore", invalid="ignore"):
+        dfun_dxy[0, 1] = -Xd * Lambda / denx**2
+        dfun_dxy[1, 0] = +Yd * Lambda / deny**2
+        dfun_dparams[0, 0] = -Xd * xy[1] * Lambda_scaling / denx**2
+        dfun_dparams[0, 1] = -Xd / denx**2
+        dfun_dparams[1, 0] = +Yd * xy[0] * Lambda_scaling / deny**2
+        dfun_dparams[1, 2] = -Yd / deny**2
+      return dfun_dxy, dfun_dparams
 
-    bcs = [xminusinfinity, yminusinfinity, xplusinfinity-1, yplusinfinity-1, Lambda * AUC + c1 - 2*NX, -Lambda * (1-AUC) + c2 - 2*NY]
-    return np.asarray(bcs[:-1])
+    def bc_jac(xyminusinfinity, xyplusinfinity, params):
+      dbc_dxya = np.zeros((5, 2))
+      dbc_dxya[0, 0] = 1
+      dbc_dxya[1, 1] = 1
+      dbc_dxyb = np.zeros((5, 2))
+      dbc_dxyb[2, 0] = 1
+      dbc_dxyb[3, 1] = 1
+      dbc_dparams = np.zeros((5, 3))
+      dbc_dparams[4, 0] = AUC * Lambda_scaling
+      dbc_dparams[4, 1] = 1
+      return dbc_dxya, dbc_dxyb, dbc_dparams
 
   if guess is not None and t_guess is None:
     raise TypeError("Have to provide t_guess if you provide guess")
   if t_guess is None:
     t_guess = np.linspace(-10, 10, 1001)
   if guess is None:
-    guess = xy_guess(X=X, Y=Y, t_guess=t_guess, AUC=AUC)
+    guess = xy_guess(X=X, Y=Y, t_guess=t_guess, AUC=AUC, NX=NX, NY=NY)
 
-  np.testing.assert_equal(t_guess.shape[0], guess.shape[1])
-  guess_dot = guess[:, 1:] - guess[:, :-1]
-  guess_dot_left = np.concatenate((guess_dot, [[0], [0]]), axis=1)
-  guess_dot_right = np.concatenate(([[0], [0]], guess_dot), axis=1)
-  slc = np.any((abs(guess_dot_left)>1e-5) | (abs(guess_dot_right)>1e-5), axis=0)
+  if t_guess.shape[0] != guess.shape[1]:
+    raise ValueError(f"t_guess has {t_guess.shape[0]} points but guess has {guess.shape[1]}")
+
+  #solve_bvp works on contiguous float64 internally; pin the dtype and
+  #layout here so it doesn't make hidden copies of whatever X and Y
+  #returned (float32, object arrays from wrapped callables, ...)
+  t_guess = np.ascontiguousarray(t_guess, dtype=np.float64)
+  guess = np.ascontiguousarray(guess, dtype=np.float64)
+  #keep a point if the guess moves between it and either neighbor
+  moving = np.any(np.abs(guess[:, 1:] - guess[:, :-1]) > 1e-5, axis=0)
+  slc = np.zeros(guess.shape[1], dtype=bool)
+  slc[:-1] = moving
+  slc[1:] |= moving
   t_guess = t_guess[slc]
   guess = guess[:, slc]
 
@@ -43,41 +191,77 @@ def optimize(*, X, Y, Xdot, Ydot, AUC, Lambda_guess, t_guess=None, guess=None, L
   c2_guess = 2*NY + Lambda_guess * (1-AUC)
   params_guess = np.array([Lambda_guess, c1_guess, c2_guess])
 
-  result = scipy.integrate.solve_bvp(fun=fun, bc=bc, x=t_guess, y=guess, p=params_guess, max_nodes=100000)
+  #tol is forwarded to solve_bvp: scans that only need the NLL to ~1e-3
+  #can relax it and skip most of the mesh-refinement cascade
+  result = scipy.integrate.solve_bvp(fun=fun, bc=bc, fun_jac=fun_jac, bc_jac=bc_jac, x=t_guess, y=guess, p=params_guess, tol=tol, max_nodes=100000)
 
-  t = (result.x[1:] + result.x[:-1]) / 2
-  dt = (result.x[1:] - result.x[:-1])
-  Xd, Yd = Xdot(t), Ydot(t)
   xd, yd = (result.yp[:, 1:] + result.yp[:, :-1]) / 2
-  if np.min(xd) <= 0 or np.min(yd) <= 0:
+  if not ((xd > 0).all() and (yd > 0).all()):
     result.NLL = np.inf
   else:
+    #only evaluate Xdot and Ydot on the midpoint grid once we know the
+    #NLL is finite - if they're KDEs or numerical derivatives this is
+    #the expensive part, and it's wasted on failed solves
+    t = (result.x[1:] + result.x[:-1]) / 2
+    dt = (result.x[1:] - result.x[:-1])
+    Xd, Yd = Xdot(t), Ydot(t)
+    #xd and yd are all positive here, so no masking is needed before the
+    #log, and einsum fuses the multiply-sum without materializing the
+    #product arrays
     result.NLL = (
-      - np.sum((Xd * np.log(xd) * dt)[xd > 0])
-      - np.sum((Yd * np.log(yd) * dt)[yd > 0])
+      - np.einsum("i,i,i->", Xd, np.log(xd), dt)
+      - np.einsum("i,i,i->", Yd, np.log(yd), dt)
     )
 
   return result
 
-def xy_guess(X, Y, t_guess, AUC):
+#each optimize call is independent, so sweeps over AUC (likelihood scans,
+#bootstraps) can run in parallel.  The common arguments are shipped to each
+#worker once via the pool initializer instead of being repickled per task.
+_optimize_batch_common = None
+
+def _optimize_batch_init(common):
+  global _optimize_batch_common
+  _optimize_batch_common = common
+
+def _optimize_batch_one(args):
+  AUC, Lambda_guess = args
+  return optimize(AUC=AUC, Lambda_guess=Lambda_guess, **_optimize_batch_common)
+
+def optimize_batch(*, X, Y, Xdot, Ydot, AUCs, Lambda_guesses, max_workers=None, **kwargs):
+  common = dict(X=X, Y=Y, Xdot=Xdot, Ydot=Ydot, **kwargs)
+  with concurrent.futures.ProcessPoolExecutor(
+    max_workers=max_workers, initializer=_optimize_batch_init, initargs=(common,),
+  ) as executor:
+    return list(executor.map(_optimize_batch_one, zip(AUCs, Lambda_guesses, strict=True)))
+
+def xy_guess(X, Y, t_guess, AUC, *, NX=None, NY=None):
   if not 0 <= AUC <= 1:
     raise ValueError(f"AUC={AUC} is not between 0 and 1")
 
+  #NX and NY can be passed in by callers (e.g. optimize) that already
+  #evaluated X and Y at infinity, so they don't get recomputed here
   if callable(X):
-    np.testing.assert_equal(X(-np.inf), 0)
-    X = X(t_guess) / X(np.inf)
+    if __debug__ and X(-np.inf) != 0:
+      raise ValueError("X(-inf) != 0")
+    if NX is None:
+      NX = X(np.inf)
+    X = X(t_guess) / NX
   if callable(Y):
-    np.testing.assert_equal(Y(-np.inf), 0)
-    Y = Y(t_guess) / Y(np.inf)
+    if __debug__ and Y(-np.inf) != 0:
+      raise ValueError("Y(-inf) != 0")
+    if NY is None:
+      NY = Y(np.inf)
+    Y = Y(t_guess) / NY
   XplusY = X + Y
   XminusY = X - Y
 
   xplusy = XplusY
 
-  def xminusy_s(s):
-    max_allowed_xminusy = np.min([xplusy, 2 - xplusy], axis=0)
-    min_allowed_xminusy = -max_allowed_xminusy
+  max_allowed_xminusy = np.minimum(xplusy, 2 - xplusy)
+  min_allowed_xminusy = -max_allowed_xminusy
 
+  def xminusy_s(s):
     if s >= 0:
       xminusy = XminusY * (1-s) + min_allowed_xminusy * s
     elif s < 0:
@@ -85,48 +269,82 @@ def xy_guess(X, Y, t_guess, AUC):
 
     return xminusy
 
-  def AUCresidual_s(s):
+  def xy_s(s):
     xminusy = xminusy_s(s)
-    x = (xplusy + xminusy) / 2
-    y = (xplusy - xminusy) / 2
-
-    AUC_s = 1/2 * np.sum((x[1:] - x[:-1]) * (y[1:] + y[:-1]))
-    return AUC_s - AUC
-
-  try:
-    np.testing.assert_allclose(AUCresidual_s(1), 1-AUC, atol=1e-4, rtol=0)
-  except AssertionError:
-    xminusy = xminusy_s(1)
-    x = (xplusy + xminusy) / 2
-    y = (xplusy - xminusy) / 2
-    for _ in zip(x, y, strict=True):
-      print(*_)
-    plt.scatter(x, y)
-    plt.show()
-    raise
-  try:
-    np.testing.assert_allclose(AUCresidual_s(-1), -AUC, atol=1e-4, rtol=0)
-  except AssertionError:
-    xminusy = xminusy_s(-1)
-    x = (xplusy + xminusy) / 2
-    y = (xplusy - xminusy) / 2
-    for _ in zip(x, y, strict=True):
-      print(*_)
-    plt.scatter(x, y)
-    plt.show()
-    raise
+    return (xplusy + xminusy) / 2, (xplusy - xminusy) / 2
+
+  #x(s) and y(s) are linear blends of two fixed endpoint curves on each
+  #side of s=0, so the trapezoidal AUC is a bilinear form in the blend
+  #coefficients.  Precompute the four trapezoid sums for each side once,
+  #and the residual inside the bisection becomes O(1) instead of O(N).
+  def trapzsum(x, y):
+    return np.trapezoid(y, x)
+
+  x_mid = (xplusy + XminusY) / 2
+  y_mid = (xplusy - XminusY) / 2
+  x_lo = (xplusy + min_allowed_xminusy) / 2
+  y_lo = (xplusy - min_allowed_xminusy) / 2
+  x_hi = (xplusy + max_allowed_xminusy) / 2
+  y_hi = (xplusy - max_allowed_xminusy) / 2
 
+  K_pos = np.array([
+    [trapzsum(x_mid, y_mid), trapzsum(x_mid, y_lo)],
+    [trapzsum(x_lo, y_mid), trapzsum(x_lo, y_lo)],
+  ])
+  K_neg = np.array([
+    [trapzsum(x_mid, y_mid), trapzsum(x_mid, y_hi)],
+    [trapzsum(x_hi, y_mid), trapzsum(x_hi, y_hi)],
+  ])
+
+  def AUCresidual_s(s):
+    if s >= 0:
+      coeffs = np.array([1-s, s])
+      K = K_pos
+    else:
+      coeffs = np.array([1+s, -s])
+      K = K_neg
+    return coeffs @ K @ coeffs - AUC
+
+  def check_bracket(s_check, expected):
+    try:
+      np.testing.assert_allclose(AUCresidual_s(s_check), expected, atol=1e-4, rtol=0)
+    except AssertionError:
+      x, y = xy_s(s_check)
+      print(np.column_stack([x, y]))
+      if _DEBUG_PLOT:
+        plt.scatter(x, y)
+        plt.show()
+      raise
+
+  #check the special cases first: for AUC of exactly 0 or 1 the root is
+  #known and the bracket sanity checks would just burn two residual
+  #evaluations
   if AUC == 1:
     s = 1
   elif AUC == 0:
     s = -1
   else:
-    result = scipy.optimize.root_scalar(AUCresidual_s, method="bisect", bracket=[-1, 1])
-    if not result.converged:
-      raise RuntimeError("Optimize didn't converge")
-    s = result.root
-
-  xminusy = xminusy_s(s)
-  x = (xplusy + xminusy) / 2
-  y = (xplusy - xminusy) / 2
-  return np.array([x, y])
+    if __debug__:
+      check_bracket(1, 1-AUC)
+      check_bracket(-1, -AUC)
+    #on each side of s=0 the AUC is quadratic in s (bilinear form in
+    #linear blend coefficients), so instead of bisecting, solve the
+    #quadratic directly
+    if AUC >= K_pos[0, 0]:
+      K = K_pos
+      sign = 1
+    else:
+      K = K_neg
+      sign = -1
+    a = K[0, 0] - K[0, 1] - K[1, 0] + K[1, 1]
+    b = -2*K[0, 0] + K[0, 1] + K[1, 0]
+    c = K[0, 0] - AUC
+    roots = np.roots([a, b, c])
+    roots = roots[np.isreal(roots)].real
+    roots = np.sort(roots[(roots >= -1e-9) & (roots <= 1+1e-9)])
+    if not len(roots):
+      raise RuntimeError(f"Couldn't find s for AUC={AUC}")
+    s = sign * np.clip(roots[0], 0, 1)
+
+  x, y = xy_s(s)
+  return np.ascontiguousarray(np.stack([x, y]), dtype=np.float64)
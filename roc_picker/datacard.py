@@ -1,7 +1,19 @@
-import argparse, itertools, pathlib, re, scipy.stats
+import argparse, functools, hashlib, itertools, matplotlib, numpy as np, pathlib
 from .delta_functions import DeltaFunctions
 from .discrete import DiscreteROC
-from .systematics_mc import ROCDistributions, ScipyDistribution
+from .systematics_mc import NormalDistribution, PoissonDistribution, ROCDistributions
+
+#directive -> (observable_type that allows it, dtype for the values),
+#hoisted so the parse loop doesn't rebuild the branch logic per line
+_NUMERIC_LINES = {
+  "observable": ("fixed", np.float64),
+  "count": ("poisson", np.int64),
+  "num": ("poisson_ratio", np.int64),
+  "denom": ("poisson_ratio", np.int64),
+}
+
+#parsed datacards keyed by content hash, see Datacard.parse_datacard
+_parsed_datacards = {}
 
 class Datacard:
   """
@@ -18,11 +30,40 @@ class Datacard:
     self.patients = patients
     self.systematics = systematics
     self.observable_type = observable_type
+    self.__systematics_mc_cache = {}
+
+  #struct-of-arrays views of the patient list, materialized once: the
+  #consumers below partition and slice these instead of looping over
+  #patient dicts.  The patient list is not supposed to be mutated after
+  #construction.
+  @functools.cached_property
+  def response_mask(self):
+    return np.fromiter((p["response"] for p in self.patients), dtype=np.bool_, count=len(self.patients))
+
+  @functools.cached_property
+  def observable_values(self):
+    return np.array([p["value"] for p in self.patients])
+
+  @functools.cached_property
+  def numerators(self):
+    return np.array([p["numerator"] for p in self.patients])
+
+  @functools.cached_property
+  def denominators(self):
+    return np.array([p["denominator"] for p in self.patients])
 
   @staticmethod
   def parse_datacard(file_path):
-    with open(file_path, 'r') as file:
-      lines = file.readlines()
+    with open(file_path, 'rb') as file:
+      content = file.read()
+
+    #repeated runs over the same card reuse the parsed object, which also
+    #shares its systematics_mc cache
+    key = hashlib.sha256(content).digest()
+    if key in _parsed_datacards:
+      return _parsed_datacards[key]
+
+    lines = content.decode().splitlines()
 
     data = {
       "patients": [],
@@ -32,35 +73,46 @@ class Datacard:
 
     responses, numerators, denominators = [], [], []
 
-    for line in lines:
-      line = line.strip()
-      if not line or line.startswith('#') or line.startswith('---'):
-        continue
+    def handle_observable_type(tokens):
+      data["observable_type"] = tokens[1]
 
-      if line.startswith("observable_type"):
-        data["observable_type"] = line.split()[1]
-      elif line.startswith("bin"):
-        continue
-      elif line.startswith("response"):
-        responses = line.split()[1:]
-        continue
-      elif line.startswith("observable"):
-        if data["observable_type"] != "fixed":
-          raise ValueError(f"Unexpected 'observable' line for observable_type '{data['observable_type']}'")
-        values = list(map(float, line.split()[1:]))
+    def handle_bin(tokens):
+      pass
+
+    def handle_response(tokens):
+      #validate once here and keep bools: downstream consumers compare
+      #responder status per patient, per MC sample
+      nonlocal responses
+      invalid = set(tokens[1:]) - {"responder", "non-responder"}
+      if invalid:
+        raise ValueError(f"Invalid responses: {sorted(invalid)}")
+      responses = [r == "responder" for r in tokens[1:]]
+
+    def handle_numeric(tokens):
+      nonlocal numerators, denominators
+      directive = tokens[0]
+      expected_type, dtype = _NUMERIC_LINES[directive]
+      if data["observable_type"] != expected_type:
+        raise ValueError(f"Unexpected '{directive}' line for observable_type '{data['observable_type']}'")
+      #numpy converts the whole token list in one C-level pass;
+      #one min-reduce validates all the counts at once
+      values = np.array(tokens[1:], dtype=dtype)
+      if dtype is np.int64 and values.size and values.min() < 0:
+        raise ValueError(f"Negative values in '{directive}' line")
+      if directive == "num":
+        numerators = values
+      elif directive == "denom":
+        denominators = values
         try:
-          for response, value in zip(responses, values, strict=True):
+          for response, num, denom in zip(responses, numerators, denominators, strict=True):
             data["patients"].append({
               "response": response,
-              "value": value
+              "numerator": num,
+              "denominator": denom
             })
         except ValueError as e:
-          raise ValueError("Mismatched lengths in responses and values") from e
-        continue
-      elif line.startswith("count"):
-        if data["observable_type"] != "poisson":
-          raise ValueError(f"Unexpected 'count' line for observable_type '{data['observable_type']}'")
-        values = list(map(int, line.split()[1:]))
+          raise ValueError("Mismatched lengths in responses, numerators, and denominators") from e
+      else:
         try:
           for response, value in zip(responses, values, strict=True):
             data["patients"].append({
@@ -69,91 +121,91 @@ class Datacard:
             })
         except ValueError as e:
           raise ValueError("Mismatched lengths in responses and values") from e
+
+    def handle_systematic(tokens):
+      #'-' maps to nan, which stays the doesn't-apply sentinel all the
+      #way to the consumers.  Substitute before building the array: an
+      #in-place replacement on a fixed-width string array would truncate
+      #"nan" when every token on the line is shorter than 3 characters.
+      data["systematics"].append({
+        "type": tokens[0],
+        "method": tokens[1],
+        "values": np.array([t if t != "-" else "nan" for t in tokens[2:]], dtype=np.float64)
+      })
+
+    #O(1) dispatch on the first token instead of walking an if/elif chain
+    #per line
+    handlers = {
+      "observable_type": handle_observable_type,
+      "bin": handle_bin,
+      "response": handle_response,
+      **dict.fromkeys(_NUMERIC_LINES, handle_numeric),
+    }
+
+    for line in lines:
+      line = line.strip()
+      if not line or line.startswith('#') or line.startswith('---'):
         continue
-      elif line.startswith("num"):
-        if data["observable_type"] != "poisson_ratio":
-          raise ValueError(f"Unexpected 'num' line for observable_type '{data['observable_type']}'")
-        numerators = list(map(int, line.split()[1:]))
-        continue
-      elif line.startswith("denom"):
-        if data["observable_type"] != "poisson_ratio":
-          raise ValueError(f"Unexpected 'denom' line for observable_type '{data['observable_type']}'")
-        denominators = list(map(int, line.split()[1:]))
-        try:
-          for response, num, denom in zip(responses, numerators, denominators, strict=True):
-            data["patients"].append({
-              "response": response,
-              "numerator": num,
-              "denominator": denom
-            })
-        except ValueError as e:
-          raise ValueError("Mismatched lengths in responses, numerators, and denominators") from e
-        continue
-      elif re.match(r'.*\s+lnN\s+.*', line):
-        tokens = line.split()
-        data["systematics"].append({
-          "type": tokens[0],
-          "method": tokens[1],
-          "values": [float(x) if x != '-' else None for x in tokens[2:]]
-        })
-        continue
+
+      #tokenize once and reuse: each branch used to re-split the line
+      tokens = line.split()
+      handler = handlers.get(tokens[0])
+      if handler is not None:
+        handler(tokens)
+      elif len(tokens) >= 2 and tokens[1] == "lnN":
+        handle_systematic(tokens)
       else:
         raise ValueError(f"Unexpected line format: {line}")
 
     if data["observable_type"] not in ["fixed", "poisson", "poisson_ratio"]:
       raise ValueError(f"Invalid observable_type: {data['observable_type']}")
 
-    return Datacard(patients=data["patients"], systematics=data["systematics"], observable_type=data["observable_type"])
+    result = Datacard(patients=data["patients"], systematics=data["systematics"], observable_type=data["observable_type"])
+    _parsed_datacards[key] = result
+    return result
 
   def systematics_mc(self, saveas=None, *, id_start=0):
+    #the distribution ids are registered globally, so rebuilding the graph
+    #with the same id_start would raise a duplicate-id error; reuse it
+    if id_start in self.__systematics_mc_cache:
+      return self.__systematics_mc_cache[id_start]
+
     id_generator = itertools.count(id_start)
-    patient_distributions = []
+    ratios = []  #one entry per patient, in patient order
 
     if self.observable_type == "fixed":
       for p in self.patients:
-        fixed_value = p["value"]
-        patient_distributions.append({
-          "response": p["response"],
-          "ratio": fixed_value
-        })
+        ratios.append(p["value"])
 
     elif self.observable_type == "poisson":
       for p in self.patients:
-        count = ScipyDistribution(nominal=p["value"], scipydistribution=scipy.stats.poisson(mu=p["value"]), id=next(id_generator))
-        patient_distributions.append({
-          "response": p["response"],
-          "ratio": count
-        })
+        ratios.append(PoissonDistribution(mu=p["value"], id=next(id_generator)))
 
     elif self.observable_type == "poisson_ratio":
       for p in self.patients:
-        numerator = ScipyDistribution(nominal=p["numerator"], scipydistribution=scipy.stats.poisson(mu=p["numerator"]), id=next(id_generator))
-        denominator = ScipyDistribution(nominal=p["denominator"], scipydistribution=scipy.stats.poisson(mu=p["denominator"]), id=next(id_generator))
-        ratio = numerator / denominator
-        patient_distributions.append({
-          "response": p["response"],
-          "ratio": ratio
-        })
+        numerator = PoissonDistribution(mu=p["numerator"], id=next(id_generator))
+        denominator = PoissonDistribution(mu=p["denominator"], id=next(id_generator))
+        ratios.append(numerator / denominator)
 
     # Apply log-normal systematics
     for systematic in self.systematics:
       if systematic["method"] == "lnN":
-        log_norm_factor = ScipyDistribution(
-          nominal=0,
-          scipydistribution=scipy.stats.norm(),
-          id=next(id_generator)
-        )
+        log_norm_factor = NormalDistribution(nominal=0, id=next(id_generator))
         try:
-          for patient, value in zip(patient_distributions, systematic["values"], strict=True):
-            if value is not None:
-              patient["ratio"] *= value ** log_norm_factor
+          for i, (ratio, value) in enumerate(zip(ratios, systematic["values"], strict=True)):
+            if not np.isnan(value):
+              ratios[i] = ratio * value ** log_norm_factor
         except ValueError as e:
           raise ValueError("Mismatched lengths in patient distributions and systematic values") from e
 
-    responders = [p["ratio"] for p in patient_distributions if p["response"] == "responder"]
-    nonresponders = [p["ratio"] for p in patient_distributions if p["response"] == "non-responder"]
+    #single pass over the patients instead of two filtering comprehensions
+    responders, nonresponders = [], []
+    for ratio, is_responder in zip(ratios, self.response_mask):
+      (responders if is_responder else nonresponders).append(ratio)
 
-    return ROCDistributions(responders=responders, nonresponders=nonresponders, flip_sign=True)
+    result = ROCDistributions(responders=responders, nonresponders=nonresponders, flip_sign=True)
+    self.__systematics_mc_cache[id_start] = result
+    return result
 
   def discrete(self, **kwargs):
     if self.observable_type != "fixed":
@@ -161,16 +213,9 @@ class Datacard:
     if self.systematics:
       raise ValueError("Can't do systematics for discrete")
 
-    responders = []
-    nonresponders = []
-    dct = {
-      "responder": responders,
-      "non-responder": nonresponders,
-    }
-    for p in self.patients:
-      dct[p["response"]].append(p["value"])
-
-    return DiscreteROC(responders=responders, nonresponders=nonresponders, **kwargs)
+    values = self.observable_values
+    mask = self.response_mask
+    return DiscreteROC(responders=values[mask], nonresponders=values[~mask], **kwargs)
 
   def delta_functions(self, **kwargs):
     if self.observable_type != "fixed":
@@ -178,56 +223,52 @@ class Datacard:
     if self.systematics:
       raise ValueError("Can't do systematics for delta_functions")
 
-    responders = []
-    nonresponders = []
-    dct = {
-      "responder": responders,
-      "non-responder": nonresponders,
-    }
-    for p in self.patients:
-      dct[p["response"]].append(p["value"])
+    values = self.observable_values
+    mask = self.response_mask
+    return DeltaFunctions(responders=values[mask], nonresponders=values[~mask], **kwargs)
 
-    return DeltaFunctions(responders=responders, nonresponders=nonresponders, **kwargs)
+def _datacard_argument_parser(description):
+  #shared base parser: every CLI starts with the datacard path
+  parser = argparse.ArgumentParser(description=description)
+  parser.add_argument("datacard", type=pathlib.Path, help="Path to the datacard file.")
+  return parser
+
+def _likelihood_scan_argument_parser(description):
+  #plot_discrete and plot_delta_functions take identical options
+  parser = _datacard_argument_parser(description)
+  parser.add_argument("--roc-filename", type=pathlib.Path, help="Path to the output file for the ROC curve.", dest="rocfilename")
+  parser.add_argument("--roc-errors-filename", type=pathlib.Path, help="Path to the output file for the ROC curve with error bands.", dest="rocerrorsfilename")
+  parser.add_argument("--scan-filename", type=pathlib.Path, help="Path to the output file for the likelihood scan", dest="scanfilename")
+  parser.add_argument("--y-upper-limit", type=float, help="y axis upper limit of the likelihood scan plot", dest="yupperlim")
+  parser.add_argument("--npoints", type=int, default=100, help="number of points in the likelihood scan")
+  parser.add_argument("--flip-sign", action="store_true", help="flip the sign of the observable (use this if AUC is < 0.5 and you want it to be > 0.5)")
+  return parser
 
 def plot_systematics_mc():
-  parser = argparse.ArgumentParser(description="Run MC method from a datacard.")
-  parser.add_argument("datacard", type=pathlib.Path, help="Path to the datacard file.")
+  #these entry points only render to files; skip any GUI backend setup
+  matplotlib.use("Agg")
+  parser = _datacard_argument_parser("Run MC method from a datacard.")
   parser.add_argument("output_file", type=pathlib.Path, help="Path to the output file for the plot.")
   parser.add_argument("--nrocs", type=int, help="Number of MC samples to generate.", default=10000, dest="size")
   parser.add_argument("--random-seed", type=int, help="Random seed for generation", dest="random_state")
+  parser.add_argument("--chunk-size", type=int, help="Generate MC samples in chunks of this size to limit peak memory.", dest="chunk_size")
 
-  args = parser.parse_args()
-  datacard = Datacard.parse_datacard(args.datacard)
+  opts = vars(parser.parse_args())
+  datacard = Datacard.parse_datacard(opts.pop("datacard"))
   rd = datacard.systematics_mc()
-  rocs = rd.generate(size=args.size, random_state=args.random_state)
-  rocs.plot(saveas=args.output_file)
+  rocs = rd.generate(size=opts.pop("size"), random_state=opts.pop("random_state"), chunk_size=opts.pop("chunk_size"))
+  rocs.plot(saveas=opts.pop("output_file"))
 
 def plot_discrete():
-  parser = argparse.ArgumentParser(description="Run discrete method from a datacard.")
-  parser.add_argument("datacard", type=pathlib.Path, help="Path to the datacard file.")
-  parser.add_argument("--roc-filename", type=pathlib.Path, help="Path to the output file for the ROC curve.", target="rocfilename")
-  parser.add_argument("--roc-errors-filename", type=pathlib.Path, help="Path to the output file for the ROC curve with error bands.", target="rocerrorsfilename")
-  parser.add_argument("--scan-filename", type=pathlib.Path, help="Path to the output file for the likelihood scan", target="scanfilename")
-  parser.add_argument("--y-upper-limit", type=float, help="y axis upper limit of the likelihood scan plot", target="yupperlimit")
-  parser.add_argument("--npoints", type=int, help="number of points in the likelihood scan", target="npoints")
-  parser.add_argument("--flip-sign", action="store_true", help="flip the sign of the observable (use this if AUC is < 0.5 and you want it to be > 0.5)")
-
-  args = parser.parse_args()
-  datacard = Datacard.parse_datacard(args.__dict__.pop("datacard"))
-  discrete = datacard.discrete()
-  discrete.plot(**args.__dict__)
+  matplotlib.use("Agg")
+  opts = vars(_likelihood_scan_argument_parser("Run discrete method from a datacard.").parse_args())
+  datacard = Datacard.parse_datacard(opts.pop("datacard"))
+  discrete = datacard.discrete(flip_sign=opts.pop("flip_sign"))
+  discrete.plot_roc(**opts)
 
 def plot_delta_functions():
-  parser = argparse.ArgumentParser(description="Run discrete method from a datacard.")
-  parser.add_argument("datacard", type=pathlib.Path, help="Path to the datacard file.")
-  parser.add_argument("--roc-filename", type=pathlib.Path, help="Path to the output file for the ROC curve.", target="rocfilename")
-  parser.add_argument("--roc-errors-filename", type=pathlib.Path, help="Path to the output file for the ROC curve with error bands.", target="rocerrorsfilename")
-  parser.add_argument("--scan-filename", type=pathlib.Path, help="Path to the output file for the likelihood scan", target="scanfilename")
-  parser.add_argument("--y-upper-limit", type=float, help="y axis upper limit of the likelihood scan plot", target="yupperlimit")
-  parser.add_argument("--npoints", type=int, help="number of points in the likelihood scan", target="npoints")
-  parser.add_argument("--flip-sign", action="store_true", help="flip the sign of the observable (use this if AUC is < 0.5 and you want it to be > 0.5)")
-
-  args = parser.parse_args()
-  datacard = Datacard.parse_datacard(args.__dict__.pop("datacard"))
-  deltafunctions = datacard.delta_functions()
-  deltafunctions.plot(**args.__dict__)
+  matplotlib.use("Agg")
+  opts = vars(_likelihood_scan_argument_parser("Run delta functions method from a datacard.").parse_args())
+  datacard = Datacard.parse_datacard(opts.pop("datacard"))
+  deltafunctions = datacard.delta_functions(flip_sign=opts.pop("flip_sign"))
+  deltafunctions.plot_roc(**opts)
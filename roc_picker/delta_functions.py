@@ -8,7 +8,7 @@ class DeltaFunctions(DiscreteROCBase):
     return 1
   @functools.cached_property
   def ts(self):
-    return sorted(set(self.responders) | set(self.nonresponders) | {np.inf, -np.inf})
+    return np.unique(np.concatenate([self.responders, self.nonresponders, [np.inf, -np.inf]]))
 
   def X(self, t):
     return sum(1 for ni in self.nonresponders if ni*self.sign < t*self.sign)
@@ -64,7 +64,7 @@ class DeltaFunctions(DiscreteROCBase):
 
       xx = x(self.ts)
       yy = y(self.ts)
-      auc = np.sum(0.5 * (xx[1:] - xx[:-1]) * (yy[1:] + yy[:-1])) * self.sign
+      auc = np.trapezoid(yy, xx) * self.sign
 
       return [
         x(np.inf)-target_at_inf,
@@ -92,7 +92,7 @@ class DeltaFunctions(DiscreteROCBase):
 
     xx = x(self.ts)
     yy = y(self.ts)
-    auc = 1/2 * np.sum((yy[1:]+yy[:-1]) * (xx[1:] - xx[:-1]))
+    auc = np.trapezoid(yy, xx)
 
     return scipy.optimize.OptimizeResult(
       xfun=x,
@@ -13,20 +13,22 @@ class DiscreteROCBase(abc.ABC):
     target_aucs = []
     NLL = []
 
-    sign = 1
-    t = np.asarray(sorted(set(self.responders) | set(self.nonresponders) | {-np.inf, np.inf}))
+    t = np.unique(np.concatenate([self.responders, self.nonresponders, [-np.inf, np.inf]]))
     if self.flip_sign:
-      sign = -1
       t = t[::-1]
 
-    @np.vectorize
-    def X(t): return sum(1 for n in self.nonresponders if n*sign < t*sign)
-    @np.vectorize
-    def Y(t): return sum(1 for r in self.responders if r*sign < t*sign)
-
-    xx = X(t) / len(self.nonresponders)
-    yy = Y(t) / len(self.responders)
-    AUC = 1/2 * np.sum((yy[1:]+yy[:-1]) * (xx[1:] - xx[:-1]))
+    #count the patients below each threshold with searchsorted on the
+    #sorted arrays instead of a python scan per threshold
+    sorted_nonresponders = np.sort(np.asarray(self.nonresponders, dtype=np.float64))
+    sorted_responders = np.sort(np.asarray(self.responders, dtype=np.float64))
+    if self.flip_sign:
+      #k*sign < t*sign with sign=-1 means k > t
+      xx = (sorted_nonresponders.size - np.searchsorted(sorted_nonresponders, t, side="right")) / len(self.nonresponders)
+      yy = (sorted_responders.size - np.searchsorted(sorted_responders, t, side="right")) / len(self.responders)
+    else:
+      xx = np.searchsorted(sorted_nonresponders, t, side="left") / len(self.nonresponders)
+      yy = np.searchsorted(sorted_responders, t, side="left") / len(self.responders)
+    AUC = np.trapezoid(yy, xx)
 
     linspaces = [
       [AUC] + [_ for _ in np.linspace(0, 1, npoints+1) if _ >= AUC],
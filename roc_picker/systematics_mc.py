@@ -1,6 +1,9 @@
-import abc, collections, functools, matplotlib.pyplot as plt, numbers, numpy as np, scipy.special
+import abc, functools, matplotlib.pyplot as plt, numbers, numpy as np, scipy.special
 
 class DistributionBase(abc.ABC):
+  #distribution objects are created per patient and per systematic, so
+  #they use __slots__ to skip the per-instance __dict__
+  __slots__ = ()
   @abc.abstractmethod
   def rvs(self, size=None, random_state=None): pass
   @property
@@ -28,6 +31,7 @@ class DistributionBase(abc.ABC):
     return PowerDistributions(other, self)
 
 class ScipyDistribution(DistributionBase):
+  __slots__ = ("__scipydistribution", "__nominal", "__id")
   __ids = {}
 
   def __init__(self, nominal, scipydistribution, id):
@@ -46,89 +50,122 @@ class ScipyDistribution(DistributionBase):
   @property
   def nominal(self): return self.__nominal
 
+class PoissonDistribution(DistributionBase):
+  #like ScipyDistribution with scipy.stats.poisson, but samples through
+  #np.random.Generator directly: no per-patient frozen scipy object to
+  #construct, and the draws happen in one C-level call
+  __slots__ = ("__mu", "__id")
+  __ids = {}
+
+  def __init__(self, mu, id):
+    self.__mu = mu
+    self.__id = id
+    if id in self.__ids:
+      raise KeyError(f"Created poisson distributions with duplicate id: {id}")
+    self.__ids[id] = self
+
+  def rvs(self, size=None, random_state=None):
+    if random_state is None: raise TypeError("Need a random state")
+    return np.random.default_rng(random_state + self.__id).poisson(self.__mu, size=size)
+
+  @property
+  def nominal(self): return self.__mu
+
+class NormalDistribution(DistributionBase):
+  __slots__ = ("__nominal", "__mu", "__sigma", "__id")
+  __ids = {}
+
+  def __init__(self, *, nominal=None, mu=0, sigma=1, id):
+    if nominal is None:
+      nominal = mu
+    self.__nominal = nominal
+    self.__mu = mu
+    self.__sigma = sigma
+    self.__id = id
+    if id in self.__ids:
+      raise KeyError(f"Created normal distributions with duplicate id: {id}")
+    self.__ids[id] = self
+
+  def rvs(self, size=None, random_state=None):
+    if random_state is None: raise TypeError("Need a random state")
+    return np.random.default_rng(random_state + self.__id).normal(self.__mu, self.__sigma, size=size)
+
+  @property
+  def nominal(self): return self.__nominal
+
+#the operand types are known at construction, so all the
+#isinstance(..., numbers.Number) classification happens in __init__
+#rather than in every rvs call
+
 class AddDistributions(DistributionBase):
+  __slots__ = ("__constant", "__distributions")
   def __init__(self, *distributions):
-    self.__distributions = distributions
+    self.__constant = sum(d for d in distributions if isinstance(d, numbers.Number))
+    self.__distributions = [d for d in distributions if not isinstance(d, numbers.Number)]
   def rvs(self, *args, **kwargs):
-    return sum(d if isinstance(d, numbers.Number) else d.rvs(*args, **kwargs) for d in self.__distributions)
+    return self.__constant + sum(d.rvs(*args, **kwargs) for d in self.__distributions)
   @property
-  def nominal(self): return sum(d if isinstance(d, numbers.Number) else d.nominal for d in self.__distributions)
+  def nominal(self): return self.__constant + sum(d.nominal for d in self.__distributions)
 
 class MultiplyDistributions(DistributionBase):
+  __slots__ = ("__constant", "__distributions")
   def __init__(self, *distributions):
-    self.__distributions = distributions
-  def rvs(self, *args, **kwargs):
-    result = 1.
-    for d in self.__distributions:
+    constant = 1.
+    self.__distributions = []
+    for d in distributions:
       if isinstance(d, numbers.Number):
-        result *= d
+        constant *= d
       else:
-        result *= d.rvs(*args, **kwargs)
+        self.__distributions.append(d)
+    self.__constant = constant
+  def rvs(self, *args, **kwargs):
+    result = self.__constant
+    for d in self.__distributions:
+      result = result * d.rvs(*args, **kwargs)
     return result
   @property
   def nominal(self):
-    result = 1.
+    result = self.__constant
     for d in self.__distributions:
-      if isinstance(d, numbers.Number):
-        result *= d
-      else:
-        result *= d.nominal
+      result = result * d.nominal
     return result
 
 class DivideDistributions(DistributionBase):
+  __slots__ = ("__num", "__denom", "__num_is_number", "__denom_is_number")
   def __init__(self, num, denom):
     self.__num = num
     self.__denom = denom
+    self.__num_is_number = isinstance(num, numbers.Number)
+    self.__denom_is_number = isinstance(denom, numbers.Number)
 
   def rvs(self, *args, **kwargs):
-    num = self.__num
-    if not isinstance(self.__num, numbers.Number):
-      num = num.rvs(*args, **kwargs)
-
-    denom = self.__denom
-    if not isinstance(self.__denom, numbers.Number):
-      denom = denom.rvs(*args, **kwargs)
-
+    num = self.__num if self.__num_is_number else self.__num.rvs(*args, **kwargs)
+    denom = self.__denom if self.__denom_is_number else self.__denom.rvs(*args, **kwargs)
     return num / denom
 
   @property
   def nominal(self):
-    num = self.__num
-    if not isinstance(self.__num, numbers.Number):
-      num = num.nominal
-
-    denom = self.__denom
-    if not isinstance(self.__denom, numbers.Number):
-      denom = denom.nominal
-
+    num = self.__num if self.__num_is_number else self.__num.nominal
+    denom = self.__denom if self.__denom_is_number else self.__denom.nominal
     return num / denom
 
 class PowerDistributions(DistributionBase):
+  __slots__ = ("__base", "__exp", "__base_is_number", "__exp_is_number")
   def __init__(self, base, exp):
     self.__base = base
     self.__exp = exp
+    self.__base_is_number = isinstance(base, numbers.Number)
+    self.__exp_is_number = isinstance(exp, numbers.Number)
 
   def rvs(self, *args, **kwargs):
-    base = self.__base
-    if not isinstance(self.__base, numbers.Number):
-      base = base.rvs(*args, **kwargs)
-
-    exp = self.__exp
-    if not isinstance(self.__exp, numbers.Number):
-      exp = exp.rvs(*args, **kwargs)
-
+    base = self.__base if self.__base_is_number else self.__base.rvs(*args, **kwargs)
+    exp = self.__exp if self.__exp_is_number else self.__exp.rvs(*args, **kwargs)
     return base ** exp
 
   @property
   def nominal(self):
-    base = self.__base
-    if not isinstance(self.__base, numbers.Number):
-      base = base.nominal
-
-    exp = self.__exp
-    if not isinstance(self.__exp, numbers.Number):
-      exp = exp.nominal
-
+    base = self.__base if self.__base_is_number else self.__base.nominal
+    exp = self.__exp if self.__exp_is_number else self.__exp.nominal
     return base ** exp
 
 class ROCDistributions:
@@ -148,10 +185,36 @@ class ROCDistributions:
   def nominal(self):
     return ROCInstance(responders=[r.nominal for r in self.responders], nonresponders=[n.nominal for n in self.nonresponders], flip_sign=self.flip_sign)
 
-  def generate(self, size, random_state):
-    responders = np.array([r.rvs(size=size, random_state=random_state) for r in self.responders])
-    nonresponders = np.array([n.rvs(size=size, random_state=random_state) for n in self.nonresponders])
-    return ROCCollection([ROCInstance(responders=responders[:, i], nonresponders=nonresponders[:, i], flip_sign=self.flip_sign) for i in range(size)], nominalroc=self.nominal)
+  def generate(self, size, random_state, chunk_size=None):
+    #same contract as rvs on the individual distributions: a missing seed
+    #fails loudly instead of drawing irreproducibly
+    if random_state is None: raise TypeError("Need a random state")
+    #chunk_size caps the size of the draws matrix held at once in the
+    #pure-Poisson fast path; the default draws everything in one call
+    if chunk_size is None:
+      chunk_size = size
+    nresponders = len(self.responders)
+    alldistributions = [*self.responders, *self.nonresponders]
+    if alldistributions and all(isinstance(d, PoissonDistribution) for d in alldistributions):
+      #pure-Poisson fast path: nothing is shared between patients, so all
+      #the draws can happen in a single C-level call per chunk
+      mus = np.array([d.nominal for d in alldistributions])
+      rng = np.random.default_rng(random_state)
+      instances = []
+      for start in range(0, size, chunk_size):
+        n = min(chunk_size, size - start)
+        draws = rng.poisson(mus[:, np.newaxis], size=(len(mus), n))
+        #copy each instance's column: a view would keep the whole chunk
+        #matrix alive for the life of the instance list, defeating the
+        #point of chunking
+        instances += [ROCInstance(responders=draws[:nresponders, i].copy(), nonresponders=draws[nresponders:, i].copy(), flip_sign=self.flip_sign) for i in range(n)]
+    else:
+      #per-distribution seeds are derived from the distribution ids, so
+      #this path can't be chunked without changing the streams
+      responders = np.array([r.rvs(size=size, random_state=random_state) for r in self.responders])
+      nonresponders = np.array([n.rvs(size=size, random_state=random_state) for n in self.nonresponders])
+      instances = [ROCInstance(responders=responders[:, i], nonresponders=nonresponders[:, i], flip_sign=self.flip_sign) for i in range(size)]
+    return ROCCollection(instances, nominalroc=self.nominal)
 
 class ROCInstance:
   #using the same convention as DiscreteROC, but with x = X and y = Y
@@ -170,32 +233,28 @@ class ROCInstance:
 
   @functools.cached_property
   def ts(self):
-    return sorted(set(self.responders) | set(self.nonresponders))
-  @functools.cached_property
-  def Xscr(self):
-    return collections.Counter(self.nonresponders)
-  @functools.cached_property
-  def Yscr(self):
-    return collections.Counter(self.responders)
+    #np.unique sorts and dedups in one C-level pass, no Python hashing
+    return np.unique(np.concatenate([
+      np.asarray(self.responders, dtype=np.float64),
+      np.asarray(self.nonresponders, dtype=np.float64),
+    ]))
 
   @functools.cached_property
   def roc(self):
-    xscr = self.Xscr
-    yscr = self.Yscr
-    x = np.zeros(shape=len(self.ts)+2)
-    y = np.zeros(shape=len(self.ts)+2)
-    sign = 1
-    ts = [-np.inf] + self.ts + [np.inf]
+    #sort each group once and count the patients below each threshold
+    #with searchsorted, instead of scanning both groups per threshold
+    responders = np.sort(np.asarray(self.responders, dtype=np.float64))
+    nonresponders = np.sort(np.asarray(self.nonresponders, dtype=np.float64))
+    ts = np.concatenate([[-np.inf], self.ts, [np.inf]])
     if self.flip_sign:
-      sign = -1
       ts = ts[::-1]
-    for i, t in enumerate(ts):
-      x[i] = sum(v for k, v in xscr.items() if k*sign < t*sign)
-      y[i] = sum(v for k, v in yscr.items() if k*sign < t*sign)
-      if x[-1]:
-        x /= x[-1]
-      if y[-1]:
-        y /= y[-1]
+      x = nonresponders.size - np.searchsorted(nonresponders, ts, side="right")
+      y = responders.size - np.searchsorted(responders, ts, side="right")
+    else:
+      x = np.searchsorted(nonresponders, ts, side="left")
+      y = np.searchsorted(responders, ts, side="left")
+    x = x / x[-1] if x[-1] else x.astype(np.float64)
+    y = y / y[-1] if y[-1] else y.astype(np.float64)
     return x, y
 
   @functools.cached_property
@@ -248,7 +307,7 @@ class ROCCollection:
     y = (self.xplusy_interp - xminusy_quantiles) / 2
     return x, y
 
-  def plot(self, saveas=None):
+  def plot(self, saveas=None, ax=None):
     sigmas = [-2, -1, 0, 1, 2]
     quantiles = [(1 + scipy.special.erf(nsigma/np.sqrt(2))) / 2 for nsigma in sigmas]
 
@@ -266,17 +325,23 @@ class ROCCollection:
     AUC_68_low, AUC_68_high = sorted([AUC_m68, AUC_p68])
     AUC_95_low, AUC_95_high = sorted([AUC_m95, AUC_p95])
 
-    fig, ax = plt.subplots(figsize=(7, 7))
+    #drawing into a caller-provided axes lets several plots share one
+    #figure; in that case the caller owns saving and showing
+    standalone = ax is None
+    if standalone:
+      fig, ax = plt.subplots(figsize=(7, 7))
 
-    plt.plot(self.nominalroc.x, self.nominalroc.y, label=f"nominal\nAUC={AUC_nominal:.2f}", color="blue")
-    plt.fill_between(x_m68, y_m68, y_p68_interp_to_m68, alpha=0.5, label=f"68% CL\nAUC$\\in$({AUC_68_low:.2f}, {AUC_68_high:.2f})", color="dodgerblue")
-    plt.fill_between(x_m95, y_m95, y_p95_interp_to_m95, alpha=0.5, label=f"95% CL\nAUC$\\in$({AUC_95_low:.2f}, {AUC_95_high:.2f})", color="skyblue")
+    ax.plot(self.nominalroc.x, self.nominalroc.y, label=f"nominal\nAUC={AUC_nominal:.2f}", color="blue")
+    ax.fill_between(x_m68, y_m68, y_p68_interp_to_m68, alpha=0.5, label=f"68% CL\nAUC$\\in$({AUC_68_low:.2f}, {AUC_68_high:.2f})", color="dodgerblue")
+    ax.fill_between(x_m95, y_m95, y_p95_interp_to_m95, alpha=0.5, label=f"95% CL\nAUC$\\in$({AUC_95_low:.2f}, {AUC_95_high:.2f})", color="skyblue")
 
-    plt.legend(fontsize=16)
-    plt.xlabel("X (Fraction of non-responders)", fontsize=16)
-    plt.ylabel("Y (Fraction of responders)", fontsize=16)
+    ax.legend(fontsize=16)
+    ax.set_xlabel("X (Fraction of non-responders)", fontsize=16)
+    ax.set_ylabel("Y (Fraction of responders)", fontsize=16)
     ax.tick_params(axis='both', which='major', labelsize=16)
+    if not standalone:
+      return
     if saveas is None:
       plt.show()
     else:
-      plt.savefig(saveas)
+      fig.savefig(saveas)
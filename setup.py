@@ -10,6 +10,9 @@ setuptools.setup(
     "numpy",
     "scipy",
   ],
+  extras_require = {
+    "numba": ["numba"],
+  },
   entry_points = {
     "console_scripts": [
       "rocpicker_mc=roc_picker.datacard:plot_systematics_mc",
@@ -1,7 +1,7 @@
 import warnings
 warnings.simplefilter("error")
 
-import matplotlib.pyplot as plt, numpy as np, pathlib, scipy.integrate, scipy.stats
+import matplotlib.pyplot as plt, numpy as np, pathlib, scipy.special
 import roc_picker.continuous_distributions
 
 here = pathlib.Path(__file__).parent
@@ -11,20 +11,34 @@ h = .6
 
 NX = NY = 3
 
+#two-component Gaussian mixtures, evaluated for both components at once
+#through the ndtr/exp ufuncs instead of scipy.stats dispatch per call
+locs_X = np.array([-1., 2.])
+locs_Y = np.array([1., -2.])
+mixture_weights = np.array([1., 2.]) / 3
+inv_sqrt_2pi = 1 / np.sqrt(2*np.pi)
+
 def X(t):
-  return (scipy.stats.norm.cdf(t, loc=-1, scale=h) + 2*scipy.stats.norm.cdf(t, loc=2, scale=h)) / 3 * NX
+  return scipy.special.ndtr((np.asarray(t)[..., np.newaxis] - locs_X) / h) @ mixture_weights * NX
 def Y(t):
-  return (scipy.stats.norm.cdf(t, loc=1, scale=h) + 2*scipy.stats.norm.cdf(t, loc=-2, scale=h)) / 3 * NY
+  return scipy.special.ndtr((np.asarray(t)[..., np.newaxis] - locs_Y) / h) @ mixture_weights * NY
 def Xdot(t):
-  return (scipy.stats.norm.pdf(t, loc=-1, scale=h) + 2*scipy.stats.norm.pdf(t, loc=2, scale=h)) / 3 * NX
+  u = (np.asarray(t)[..., np.newaxis] - locs_X) / h
+  return np.exp(-u*u/2) @ mixture_weights * (inv_sqrt_2pi / h) * NX
 def Ydot(t):
-  return (scipy.stats.norm.pdf(t, loc=1, scale=h) + 2*scipy.stats.norm.pdf(t, loc=-2, scale=h)) / 3 * NY
+  u = (np.asarray(t)[..., np.newaxis] - locs_Y) / h
+  return np.exp(-u*u/2) @ mixture_weights * (inv_sqrt_2pi / h) * NY
 
 t_plot = np.linspace(-10, 10, 1001)
-dt_plot = t_plot[1] - t_plot[0]
 NX = X(np.inf)
 NY = Y(np.inf)
-AUC = np.sum(Y(t_plot)/NY * Xdot(t_plot)/NX) * dt_plot
+#the distributions on the plotting grid never change; evaluate them once
+#and reuse everywhere instead of recomputing per plot and per run() call
+X_tplot = X(t_plot)
+Y_tplot = Y(t_plot)
+Xdot_tplot = Xdot(t_plot)
+Ydot_tplot = Ydot(t_plot)
+AUC = np.trapezoid(Y_tplot/NY * Xdot_tplot/NX, t_plot)
 
 def run(target_AUC, verbose=True, prev_rocs={AUC: (t_plot, X, Y, None, None)}):
   AUC_for_guess = min(prev_rocs.keys(), key=lambda x: abs(x-target_AUC))
@@ -49,20 +63,20 @@ def run(target_AUC, verbose=True, prev_rocs={AUC: (t_plot, X, Y, None, None)}):
   Lambda, c1, c2 = optimize_result.p
 
   if verbose:
-    plt.scatter(X(t_plot)/NX, Y(t_plot)/NY, label="X, Y")
+    plt.scatter(X_tplot/NX, Y_tplot/NY, label="X, Y")
     plt.scatter(xy_guess[0], xy_guess[1], label="guess")
     plt.scatter(xy[0], xy[1], label="optimized")
     print("=========================")
     print("should be 0:", x[0], y[0])
     print("should be 1:", x[-1], y[-1])
-    print("should be equal:", target_AUC, 1/2 * np.sum((y[1:]+y[:-1]) * (x[1:] - x[:-1])))
+    print("should be equal:", target_AUC, np.trapezoid(y, x))
     print("should be equal:", c1, 2*NX - Lambda*target_AUC)
     print("should be equal:", c2, 2*NY + Lambda*(1-target_AUC))
     print("=========================")
     plt.legend()
     plt.show()
 
-  if optimize_result is not prev_result and optimize_result.success and np.isclose(target_AUC, 1/2 * np.sum((y[1:]+y[:-1]) * (x[1:] - x[:-1])), rtol=0, atol=1e-3):
+  if optimize_result is not prev_result and optimize_result.success and np.isclose(target_AUC, np.trapezoid(y, x), rtol=0, atol=1e-3):
     slc = slice(None)#(xd>0) & (yd>0)
     prev_rocs[target_AUC] = t[slc], x[slc], y[slc], Lambda, optimize_result
 
@@ -85,7 +99,7 @@ def plot_params(*, skip_aucs=[], show=False):
       if target_auc in skip_aucs: continue
       result = run(target_auc, verbose=False)
       x, y = result.y
-      auc = 1/2 * np.sum((y[1:]+y[:-1]) * (x[1:] - x[:-1]))
+      auc = np.trapezoid(y, x)
       delta_auc = auc - target_auc
       if not result.success or abs(delta_auc) > 1e-2:
         print("failed", target_auc)
@@ -136,8 +150,8 @@ def plot_params(*, skip_aucs=[], show=False):
 
 def plots(show=False):
   plt.figure(figsize=(5, 5))
-  plt.scatter(t_plot, Xdot(t_plot), label=r"$\dot{X}$")
-  plt.scatter(t_plot, Ydot(t_plot), label=r"$\dot{Y}$")
+  plt.scatter(t_plot, Xdot_tplot, label=r"$\dot{X}$")
+  plt.scatter(t_plot, Ydot_tplot, label=r"$\dot{Y}$")
   plt.xlabel("$t$")
   plt.ylabel(r"$\dot{X}$, $\dot{Y}$")
   plt.legend()
@@ -147,8 +161,8 @@ def plots(show=False):
   plt.close()
 
   plt.figure(figsize=(5, 5))
-  plt.scatter(t_plot, X(t_plot), label=r"$X$")
-  plt.scatter(t_plot, Y(t_plot), label=r"$Y$")
+  plt.scatter(t_plot, X_tplot, label=r"$X$")
+  plt.scatter(t_plot, Y_tplot, label=r"$Y$")
   plt.xlabel("$t$")
   plt.ylabel(r"$X$, $Y$")
   plt.legend()
@@ -158,7 +172,7 @@ def plots(show=False):
   plt.close()
 
   plt.figure(figsize=(5, 5))
-  plt.scatter(X(t_plot)/NX, Y(t_plot)/NY)
+  plt.scatter(X_tplot/NX, Y_tplot/NY)
   plt.xlabel("$X$")
   plt.ylabel("$Y$")
   plt.xlim(0, 1)
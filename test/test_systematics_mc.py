@@ -3,7 +3,7 @@
 import warnings
 warnings.simplefilter("error")
 
-import pathlib
+import numpy as np, pathlib
 from roc_picker.datacard import Datacard
 
 here = pathlib.Path(__file__).parent
@@ -32,7 +32,42 @@ def plot(datacard, output, id_start=0, size=10000, random_state=123456):
   rocs = rd.generate(size=size, random_state=random_state)
   rocs.plot(output)
 
+def check_chunked_generate():
+  #the pure-poisson fast path is the only one that chunks; none of the
+  #plotting datacards take it, so exercise it directly
+  d = Datacard.parse_datacard(pathlib.Path(__file__).parent/"datacards"/"datacard_counts_no_systematics.txt")
+  rd = d.systematics_mc(id_start=400)
+  rocs = rd.generate(size=10, random_state=123456, chunk_size=3)
+  assert len(rocs.rocinstances) == 10
+  for instance in rocs.rocinstances:
+    #each instance has to own its draws - a view would keep the whole
+    #chunk matrix alive, so chunking wouldn't reduce peak memory
+    assert instance.responders.base is None
+    assert instance.nonresponders.base is None
+  #same seed and chunking gives the same rocs
+  rocs2 = rd.generate(size=10, random_state=123456, chunk_size=3)
+  for roc, roc2 in zip(rocs.rocinstances, rocs2.rocinstances, strict=True):
+    np.testing.assert_array_equal(roc.responders, roc2.responders)
+    np.testing.assert_array_equal(roc.nonresponders, roc2.nonresponders)
+  #both branches of generate require a seed
+  try:
+    rd.generate(size=10, random_state=None)
+  except TypeError:
+    pass
+  else:
+    raise AssertionError("generate without a random state should raise TypeError")
+
+def check_short_systematic_tokens():
+  #systematic lines whose tokens are all shorter than "nan" (e.g. "2", "-")
+  #used to crash the parser
+  d = Datacard.parse_datacard(pathlib.Path(__file__).parent/"datacards"/"datacard_short_systematic.txt")
+  np.testing.assert_array_equal(d.systematics[0]["values"], [2, np.nan, 2, np.nan])
+  np.testing.assert_array_equal(d.systematics[1]["values"], [np.nan]*4)
+
 if __name__ == "__main__":
+  check_chunked_generate()
+  check_short_systematic_tokens()
+
   # Generate plots for neighborhoods without systematics (Poisson uncertainty)
   plot(datacards["neighborhoods_no_systematics"], output_paths["poisson_roc_neighborhoods"])
 